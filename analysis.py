@@ -0,0 +1,152 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the batch orbit analysis functions, used to classify the orbits of many points
+at once without drawing anything.
+
+The points are iterated together in blocks with NumPy, and the blocks are shared between a pool of
+processes. Each point is classified in the same way as Fractal.classify.
+"""
+import math
+import os
+
+import numpy as np
+
+from fractal import MAX_IT, MAX_PATTERN
+from backends import get_backend, process_pool
+from math_functions import pattern_lengths
+
+# The most orbit points held in memory by each process at once
+BLOCK_POINTS = 2 ** 22
+
+ORBIT_DTYPE = np.dtype([('kind', 'U10'),
+                        ('period', np.int32),
+                        ('fixed_point', np.complex128),
+                        ('escape', np.int64)])
+
+
+def _analyse_block(c: np.ndarray, z0: np.ndarray, power: float, valid_radius: float,
+                   max_it: int, backend: str = None) -> np.ndarray:
+    """
+    Classifies the orbits of a one dimensional block of points, iterating them in lockstep with
+    the pow of the backend with the given name
+    """
+    complex_pow = get_backend(backend).pow
+    rows = len(c)
+    result = np.zeros(rows, dtype=ORBIT_DTYPE)
+    result['fixed_point'] = complex(np.nan, np.nan)
+
+    # Iterate every point, keeping the sequences and removing points once they diverge
+    orbits = np.zeros((rows, max_it), dtype=np.complex128)
+    total_re, total_im = np.zeros(rows), np.zeros(rows)
+    index = np.arange(rows)
+    c_re, c_im = c.real.copy(), c.imag.copy()
+    z_re, z_im = z0.real.copy(), z0.imag.copy()
+    for step in range(max_it):
+        valid = np.hypot(z_re, z_im) <= valid_radius
+        if not valid.all():
+            index, c_re, c_im, z_re, z_im = \
+                index[valid], c_re[valid], c_im[valid], z_re[valid], z_im[valid]
+            if index.size == 0:
+                break
+        z_re, z_im = complex_pow(z_re, z_im, power)
+        z_re = z_re + c_re
+        z_im = z_im + c_im
+        orbits.real[index, step] = z_re
+        orbits.imag[index, step] = z_im
+        total_re[index] += z_re
+        total_im[index] += z_im
+        result['escape'][index] += 1
+
+    divergent = result['escape'] < max_it
+    result['kind'][divergent] = 'divergent'
+
+    # The remaining sequences are convergent if every distance between consecutive points is at
+    # least the mean of the distances after it
+    bounded = np.flatnonzero(~divergent)
+    if bounded.size == 0:
+        return result
+
+    orbits = orbits[bounded]
+    center = np.empty(bounded.size, dtype=np.complex128)
+    center.real = total_re[bounded] / max_it
+    center.imag = total_im[bounded] / max_it
+    m = (max_it * (1 - 1 / np.exp(np.abs(center)))).astype(np.int64)
+
+    step = np.diff(orbits, axis=1)
+    d_seq = np.sqrt(np.abs(step.real) ** 2 + np.abs(step.imag) ** 2)
+    i = np.arange(max_it - 1)
+    d_seq[i >= m[:, np.newaxis]] = 0
+
+    after_sum = np.zeros_like(d_seq)
+    after_sum[:, :-1] = np.cumsum(d_seq[:, :0:-1], axis=1)[:, ::-1]
+    after_len = m[:, np.newaxis] - 1 - i
+    with np.errstate(divide='ignore', invalid='ignore'):
+        passed = (d_seq >= after_sum / after_len) | (after_len <= 0)
+    convergent = passed.all(axis=1)
+
+    result['kind'][bounded[convergent]] = 'convergent'
+    result['fixed_point'][bounded[convergent]] = center[convergent]
+
+    # The patterns of the rest are found together, in the same way as get_pattern
+    rest = np.flatnonzero(~convergent)
+    period = pattern_lengths(orbits[rest, -MAX_PATTERN:])
+    chaotic = (period == 0) | (period == MAX_PATTERN // 4 + 1)
+    result['kind'][bounded[rest[chaotic]]] = 'chaotic'
+    result['kind'][bounded[rest[~chaotic]]] = 'cyclic'
+    result['period'][bounded[rest[~chaotic]]] = period[~chaotic]
+
+    return result
+
+
+def analyse_orbits(c: np.ndarray, z0=complex(0, 0), power: float = 2.0,
+                   valid_radius: float = 2, max_it: int = MAX_IT,
+                   workers: int = None, backend: str = None) -> np.ndarray:
+    """
+    Classifies the orbit of every point in c for the Mandelbrot set (or one of its derivatives)
+    with the given parameters
+
+    z0 may be a single value or an array with the same shape as c, to compare different
+    initial iteration values. Returns a structured array with the same shape as c, with fields:
+      - kind: one of 'divergent', 'convergent', 'cyclic' or 'chaotic'
+      - period: the period of the pattern of a cyclic orbit, otherwise 0
+      - fixed_point: the point a convergent orbit approaches, otherwise nan
+      - escape: the number of iterations before divergence, as given by MandelbrotSet.base
+        (equal to max_it if the orbit does not diverge)
+
+    If workers is 1 the points are classified in this process, otherwise the blocks of points are
+    shared between a pool of (at most workers) processes. The points are raised to the power by
+    the backend with the given name, or by the fastest available backend if backend is None (see
+    backends.py).
+    """
+    c = np.asarray(c, dtype=np.complex128)
+    flat_c = c.ravel()
+    flat_z0 = np.broadcast_to(np.asarray(z0, dtype=np.complex128), c.shape).ravel()
+
+    # Blocks are small enough that every process gets one, even for a few thousand points
+    processes = 1 if workers == 1 else workers or os.cpu_count() or 1
+    rows = max(1, min(BLOCK_POINTS // max(1, max_it), math.ceil(flat_c.size / processes)))
+    blocks = [(flat_c[i:i + rows], flat_z0[i:i + rows], power, valid_radius, max_it, backend)
+              for i in range(0, flat_c.size, rows)]
+
+    if workers == 1 or len(blocks) <= 1:
+        results = [_analyse_block(*block) for block in blocks]
+    else:
+        with process_pool(workers) as executor:
+            results = list(executor.map(_analyse_block, *zip(*blocks)))
+
+    if not results:
+        return np.zeros(c.shape, dtype=ORBIT_DTYPE)
+    return np.concatenate(results).reshape(c.shape)
+
+
+def read_c_values(local_address: str, skip_rows: int = 0) -> np.ndarray:
+    """
+    Reads an array of points from a CSV file, with either a real and an imaginary column or a
+    single column of complex numbers written like 1+2j
+    """
+    values = np.loadtxt(local_address, delimiter=',', dtype=str, skiprows=skip_rows, ndmin=2)
+    if values.shape[1] >= 2:
+        return values[:, 0].astype(float) + 1j * values[:, 1].astype(float)
+    return values[:, 0].astype(complex)
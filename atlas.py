@@ -0,0 +1,122 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the parameter space atlas, used to see how the Mandelbrot set changes as z0 and
+the power change.
+
+Instead of creating a MandelbrotSet for every combination (each one scanning for its ranges and
+rendering a full screen image), the atlas renders a small thumbnail of every combination on a pool
+of processes and arranges them in a contact sheet, with one row per power and one column per z0.
+Combinations are handed to the processes in batches. With a shared view, the ranges of every
+combination are found first and combined, so that every thumbnail shows the same region of the
+complex plane.
+"""
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from backends import process_pool
+from fractal import MAX_IT, colour_counts, fit_ranges, scan_bounds, symmetric_counts
+from mandelbrot import escape_counts, mandelbrot_symmetries
+from math_functions import DRange
+
+IM_BUFFER = 0.2
+SCAN_STEP = 0.1  # Coarser than Fractal._init_image's grid, but well inside IM_BUFFER
+MARGIN = 4
+LABEL_HEIGHT = 14
+
+
+def _cell_bounds(z0: complex, power: float) -> tuple:
+    """
+    Returns the ranges of the set with the given z0 and power, found in the same way as
+    Fractal._init_image but on a coarser grid
+    """
+    return scan_bounds(lambda c: escape_counts(c, z0, power, 2, MAX_IT), IM_BUFFER, SCAN_STEP)
+
+
+def _render_cell(z0: complex, power: float, view, width: int, height: int,
+                 max_it: int) -> np.ndarray:
+    """
+    Renders the thumbnail of the set with the given z0 and power, over the given view (a pair of
+    ranges) or over the set's own ranges if view is None
+    """
+    if view is None:
+        x_range, y_range = _cell_bounds(z0, power)
+    else:
+        x_range, y_range = DRange(view[0].max, view[0].min), DRange(view[1].max, view[1].min)
+    fit_ranges(x_range, y_range, width, height, contain=True)
+
+    counts = symmetric_counts(lambda c: escape_counts(c, z0, power, 2, max_it),
+                              mandelbrot_symmetries(z0, power), x_range, y_range, width, height)
+    return colour_counts(counts, max_it)
+
+
+def _render_cells(cells: list, view, width: int, height: int, max_it: int) -> list:
+    """
+    Renders a batch of thumbnails in a single process
+    """
+    return [_render_cell(z0, power, view, width, height, max_it) for z0, power in cells]
+
+
+def render_atlas(z0_values: list, powers: list, local_address: str = None, width: int = 160,
+                 height: int = 120, max_it: int = MAX_IT, shared_view: bool = False,
+                 labels: bool = True, workers: int = None, batch: int = None) -> Image.Image:
+    """
+    Returns a contact sheet of thumbnails of the Mandelbrot set, with one row for each power and
+    one column for each value of z0, and saves it as a PNG at the given local address if one is
+    given
+
+    If shared_view is True every thumbnail shows the same region, large enough to contain every
+    set in the sweep. Otherwise each thumbnail is fitted to its own set. Combinations are sent to
+    the processes in batches of the given size (by default, enough for about four batches per
+    process).
+    """
+    z0_values = [complex(z0) for z0 in z0_values]
+    powers = [float(power) for power in powers]
+    cells = [(z0, power) for power in powers for z0 in z0_values]
+
+    if batch is None:
+        batch = max(1, len(cells) // (4 * (workers or os.cpu_count() or 1)))
+    batches = [cells[i:i + batch] for i in range(0, len(cells), batch)]
+
+    # The coarse scans are quick enough to find the shared view in this process
+    view = None
+    if shared_view:
+        bounds = [_cell_bounds(z0, power) for z0, power in cells]
+        view = (DRange(max(x.max for x, _ in bounds), min(x.min for x, _ in bounds)),
+                DRange(max(y.max for _, y in bounds), min(y.min for _, y in bounds)))
+
+    with process_pool(workers) as executor:
+        n = len(batches)
+        thumbnails = [thumbnail for result in executor.map(_render_cells, batches, [view] * n,
+                                                           [width] * n, [height] * n,
+                                                           [max_it] * n)
+                      for thumbnail in result]
+
+    label_height = LABEL_HEIGHT if labels else 0
+    cell_width = width + MARGIN
+    cell_height = height + label_height + MARGIN
+    sheet = Image.new('RGB', (MARGIN + cell_width * len(z0_values),
+                              MARGIN + cell_height * len(powers)), (0, 0, 0))
+    draw = ImageDraw.Draw(sheet)
+
+    for k, ((z0, power), thumbnail) in enumerate(zip(cells, thumbnails)):
+        x = MARGIN + cell_width * (k % len(z0_values))
+        y = MARGIN + cell_height * (k // len(z0_values))
+        sheet.paste(Image.fromarray(thumbnail), (x, y + label_height))
+        if labels:
+            draw.text((x, y), 'z0=%s p=%g' % (complex(round(z0.real, 3), round(z0.imag, 3)),
+                                              power), fill=(255, 255, 255))
+
+    if local_address is not None:
+        sheet.save(local_address + '.png')
+    return sheet
+
+
+if __name__ == '__main__':
+    import sys
+
+    render_atlas(np.linspace(0, 0.5, 6), [2, 3, 4, 5], sys.argv[1] if len(sys.argv) > 1
+                 else 'atlas')
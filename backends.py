@@ -0,0 +1,417 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the iteration backends, which compute escape times and orbits of the Mandelbrot
+set (and its derivatives) in different ways:
+  - python: the same loops as MandelbrotSet.base and MandelbrotSet.point, one point at a time
+  - numpy: every point iterated in lockstep with NumPy arrays
+  - numba: compiled loops with an early exit for every pixel, spread over all cores (only available
+    if numba is installed)
+
+Every backend uses the same floating point operations as python's built-in pow, so they all give
+exactly the same iteration counts. Running this file (or test_backends.py) checks that they do.
+"""
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:  # numba is optional, the numba backend is only available if it is installed
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None and numba.config.THREADING_LAYER not in ('tbb', 'omp'):
+    # The compiled loops may be run from several threads at once (by the background renderer,
+    # for example), which the workqueue threading layer can not do
+    numba.config.THREADING_LAYER = 'threadsafe'
+
+
+_pow = np.frompyfunc(pow, 2, 1)
+
+
+def _is_integer_power(power: float) -> bool:
+    """
+    Returns whether python's pow uses repeated multiplication for the given power
+    """
+    return power == math.floor(power) and abs(power) <= 100
+
+
+def complex_pow(re: np.ndarray, im: np.ndarray, power: float) -> tuple:
+    """
+    Raises the complex numbers re + i * im to a real power
+
+    This uses the same floating point operations as python's built-in pow, so that the vectorized
+    functions give exactly the same iteration counts as MandelbrotSet.base. Integer powers (the
+    usual case) only need multiplication, so they are much faster than other powers.
+    """
+    if _is_integer_power(power):
+        # Binary exponentiation, as python uses for integer powers
+        n = abs(int(power))
+        r_re, r_im = np.ones_like(re), np.zeros_like(im)
+        p_re, p_im = re, im
+        first = True
+        while n > 0:
+            if n & 1:
+                if first:
+                    r_re, r_im = p_re, p_im
+                    first = False
+                else:
+                    r_re, r_im = r_re * p_re - r_im * p_im, r_re * p_im + r_im * p_re
+            n >>= 1
+            if n > 0:
+                p_re, p_im = p_re * p_re - p_im * p_im, p_re * p_im + p_im * p_re
+
+        if power >= 0:
+            return r_re, r_im
+
+        # 1 / r, using the same division algorithm as python
+        with np.errstate(divide='ignore', invalid='ignore'):
+            real_larger = abs(r_re) >= abs(r_im)
+            ratio = np.where(real_larger, r_im / r_re, r_re / r_im)
+            denom = np.where(real_larger, r_re + r_im * ratio, r_re * ratio + r_im)
+            return np.where(real_larger, 1 / denom, ratio / denom), \
+                np.where(real_larger, -ratio / denom, -1 / denom)
+
+    # NumPy's own pow, atan2, cos and sin can differ from the C library's (which python uses) in
+    # the last bit, so python's pow is called one element at a time here. 0 stays at 0, where
+    # python's pow would fail for a negative power.
+    zero = (re == 0) & (im == 0)
+    z = np.empty(np.shape(re), dtype=np.complex128)
+    z.real = np.where(zero, 1.0, re)
+    z.imag = im
+    z = _pow(z, power).astype(np.complex128)
+    return np.where(zero, 0.0, z.real), np.where(zero, 0.0, z.imag)
+
+
+class Backend:
+    """
+    The base class of the iteration backends
+
+    Instance Attributes:
+      - name: the name the backend is selected by
+      - parallel: whether the backend already spreads each call over every core
+    """
+    name = ''
+    parallel = False
+
+    def escape_counts(self, c: np.ndarray, z0: complex, power: float, valid_radius: float,
+                      max_it: int) -> np.ndarray:
+        """
+        A function made to be overloaded, returning the number of iterations before each element
+        of c becomes divergent, as given by MandelbrotSet.base
+        """
+        pass
+
+    def orbit_into(self, out: np.ndarray, z: complex, c: complex, power: float,
+                   valid_radius: float) -> tuple:
+        """
+        A function made to be overloaded, continuing the sequence of iterations at c from z and
+        writing each new iteration into out until the sequence diverges or out is full
+
+        Returns the number of iterations written and the last iteration (or z if there were none)
+        """
+        pass
+
+    def pow(self, re: np.ndarray, im: np.ndarray, power: float) -> tuple:
+        """
+        Raises the complex numbers re + i * im to a real power, in the same way as complex_pow
+
+        This is used to iterate many orbits in lockstep (see analysis.py and buddhabrot.py).
+        """
+        return complex_pow(re, im, power)
+
+    def orbit(self, c: complex, z0: complex, power: float, valid_radius: float,
+              max_it: int) -> np.ndarray:
+        """
+        Returns the sequence of iterations at c, as given by MandelbrotSet.point
+        """
+        out = np.empty(max_it, dtype=np.complex128)
+        n, _ = self.orbit_into(out, z0, c, power, valid_radius)
+        return out[:n]
+
+
+class PythonBackend(Backend):
+    """
+    Iterates one point at a time with python's complex numbers
+    """
+    name = 'python'
+
+    def escape_counts(self, c: np.ndarray, z0: complex, power: float, valid_radius: float,
+                      max_it: int) -> np.ndarray:
+        c = np.asarray(c, dtype=np.complex128)
+        counts = np.zeros(c.size, dtype=np.int64)
+        for k, ck in enumerate(c.ravel().tolist()):
+            n = 0
+            z = z0
+            while abs(z) <= valid_radius and n < max_it:
+                z = pow(z, power) + ck
+                n += 1
+            counts[k] = n
+        return counts.reshape(c.shape)
+
+    def orbit_into(self, out: np.ndarray, z: complex, c: complex, power: float,
+                   valid_radius: float) -> tuple:
+        i = 0
+        while i < len(out) and abs(z) <= valid_radius:
+            z = pow(z, power) + c
+            out[i] = z
+            i += 1
+        return i, z
+
+
+class NumpyBackend(PythonBackend):
+    """
+    Iterates every point in lockstep with NumPy arrays, removing points as soon as they diverge
+
+    A single orbit can not be vectorized, so orbits are found in the same way as PythonBackend.
+    """
+    name = 'numpy'
+
+    def escape_counts(self, c: np.ndarray, z0: complex, power: float, valid_radius: float,
+                      max_it: int) -> np.ndarray:
+        c = np.asarray(c, dtype=np.complex128)
+        flat_c = c.ravel()
+        counts = np.zeros(flat_c.shape, dtype=np.int64)
+
+        index = np.arange(flat_c.size)
+        c_re, c_im = flat_c.real.copy(), flat_c.imag.copy()
+        z_re = np.full(flat_c.shape, complex(z0).real)
+        z_im = np.full(flat_c.shape, complex(z0).imag)
+
+        for _ in range(max_it):
+            valid = np.hypot(z_re, z_im) <= valid_radius
+            if not valid.all():
+                index, c_re, c_im, z_re, z_im = \
+                    index[valid], c_re[valid], c_im[valid], z_re[valid], z_im[valid]
+                if index.size == 0:
+                    break
+            z_re, z_im = complex_pow(z_re, z_im, power)
+            z_re = z_re + c_re
+            z_im = z_im + c_im
+            counts[index] += 1
+
+        return counts.reshape(c.shape)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _numba_pow(re: float, im: float, power: float, integer: bool) -> tuple:
+        """
+        A compiled version of complex_pow for a single complex number
+        """
+        if integer:
+            n = abs(int(power))
+            r_re, r_im = 1.0, 0.0
+            p_re, p_im = re, im
+            first = True
+            while n > 0:
+                if n & 1:
+                    if first:
+                        r_re, r_im = p_re, p_im
+                        first = False
+                    else:
+                        r_re, r_im = r_re * p_re - r_im * p_im, r_re * p_im + r_im * p_re
+                n >>= 1
+                if n > 0:
+                    p_re, p_im = p_re * p_re - p_im * p_im, p_re * p_im + p_im * p_re
+
+            if power >= 0:
+                return r_re, r_im
+            if abs(r_re) >= abs(r_im):
+                ratio = r_im / r_re
+                denom = r_re + r_im * ratio
+                return 1 / denom, -ratio / denom
+            ratio = r_re / r_im
+            denom = r_re * ratio + r_im
+            return ratio / denom, -1 / denom
+
+        if re == 0 and im == 0:
+            return 0.0, 0.0
+        length = math.pow(math.hypot(re, im), power)
+        phase = math.atan2(im, re) * power
+        return length * math.cos(phase), length * math.sin(phase)
+
+    def _escape_counts_loop(c_re: np.ndarray, c_im: np.ndarray, z0_re: float, z0_im: float,
+                            power: float, integer: bool, valid_radius: float, max_it: int,
+                            counts: np.ndarray) -> None:
+        """
+        Writes the number of iterations before each point diverges into counts, one thread per
+        share of the points (when compiled with parallel=True)
+        """
+        for k in numba.prange(c_re.size):
+            z_re, z_im = z0_re, z0_im
+            n = 0
+            while math.hypot(z_re, z_im) <= valid_radius and n < max_it:
+                z_re, z_im = _numba_pow(z_re, z_im, power, integer)
+                z_re += c_re[k]
+                z_im += c_im[k]
+                n += 1
+            counts[k] = n
+
+    _numba_escape_counts = numba.njit(parallel=True, cache=True)(_escape_counts_loop)
+    # Used instead if no threadsafe threading layer (tbb or omp) can be loaded
+    _numba_escape_counts_serial = numba.njit(_escape_counts_loop)
+
+    @numba.njit(cache=True)
+    def _numba_pow_arrays(re: np.ndarray, im: np.ndarray, power: float, integer: bool) -> tuple:
+        """
+        A compiled version of complex_pow
+        """
+        out_re = np.empty(re.size)
+        out_im = np.empty(re.size)
+        for k in range(re.size):
+            out_re[k], out_im[k] = _numba_pow(re[k], im[k], power, integer)
+        return out_re, out_im
+
+    @numba.njit(cache=True)
+    def _numba_orbit_into(out: np.ndarray, z_re: float, z_im: float, c_re: float, c_im: float,
+                          power: float, integer: bool, valid_radius: float) -> tuple:
+        """
+        A compiled version of Backend.orbit_into
+        """
+        i = 0
+        while i < out.size and math.hypot(z_re, z_im) <= valid_radius:
+            z_re, z_im = _numba_pow(z_re, z_im, power, integer)
+            z_re += c_re
+            z_im += c_im
+            out[i] = complex(z_re, z_im)
+            i += 1
+        return i, z_re, z_im
+
+
+class NumbaBackend(Backend):
+    """
+    Iterates every point in compiled loops, each point stopping as soon as it diverges, with the
+    points shared between all cores
+
+    If neither the tbb nor the omp threading layer can be loaded, the points are iterated on a
+    single core instead, since the compiled loops may be run from several threads at once.
+    """
+    name = 'numba'
+    parallel = True
+
+    def escape_counts(self, c: np.ndarray, z0: complex, power: float, valid_radius: float,
+                      max_it: int) -> np.ndarray:
+        c = np.asarray(c, dtype=np.complex128)
+        flat_c = c.ravel()
+        counts = np.zeros(flat_c.shape, dtype=np.int64)
+        args = (np.ascontiguousarray(flat_c.real), np.ascontiguousarray(flat_c.imag),
+                complex(z0).real, complex(z0).imag, float(power), _is_integer_power(power),
+                float(valid_radius), int(max_it), counts)
+
+        if NumbaBackend.parallel:
+            try:
+                _numba_escape_counts(*args)
+                return counts.reshape(c.shape)
+            except ValueError:  # No threadsafe threading layer could be loaded
+                NumbaBackend.parallel = False
+        _numba_escape_counts_serial(*args)
+        return counts.reshape(c.shape)
+
+    def pow(self, re: np.ndarray, im: np.ndarray, power: float) -> tuple:
+        re, im = np.asarray(re, dtype=np.float64), np.asarray(im, dtype=np.float64)
+        out_re, out_im = _numba_pow_arrays(np.ascontiguousarray(re).ravel(),
+                                           np.ascontiguousarray(im).ravel(), float(power),
+                                           _is_integer_power(power))
+        return out_re.reshape(re.shape), out_im.reshape(im.shape)
+
+    def orbit_into(self, out: np.ndarray, z: complex, c: complex, power: float,
+                   valid_radius: float) -> tuple:
+        z, c = complex(z), complex(c)
+        i, z_re, z_im = _numba_orbit_into(out, z.real, z.imag, c.real, c.imag, float(power),
+                                          _is_integer_power(power), float(valid_radius))
+        return i, complex(z_re, z_im)
+
+
+BACKENDS = {backend.name: backend for backend in (PythonBackend, NumpyBackend, NumbaBackend)}
+
+
+def available_backends() -> list:
+    """
+    Returns the names of the backends that can be used, from slowest to fastest
+    """
+    names = ['python', 'numpy']
+    if numba is not None:
+        names.append('numba')
+    return names
+
+
+def get_backend(name: str = None) -> Backend:
+    """
+    Returns the backend with the given name, or the fastest available backend if name is None
+
+    Raise a ValueError if the backend does not exist or can not be used.
+    """
+    if name is None:
+        name = available_backends()[-1]
+    if name not in available_backends():
+        raise ValueError('Backend %r does not exist or can not be used, the available backends '
+                         'are %s' % (name, ', '.join(available_backends())))
+    return BACKENDS[name]()
+
+
+def _init_worker() -> None:
+    """
+    Runs the numba backend on a single thread in a process of a pool, since the pool's processes
+    already share out the cores
+    """
+    if numba is not None:
+        numba.set_num_threads(1)
+
+
+def process_pool(workers: int = None) -> ProcessPoolExecutor:
+    """
+    Returns a pool of the given number of processes (or one per core) to run the backends in
+
+    The processes are started with spawn rather than fork. Once the numba backend has run in this
+    process its worker threads are running, and a forked copy of them can stop the process from
+    ever exiting.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker)
+
+
+def check_backends(size: int = 200, max_it: int = 256) -> dict:
+    """
+    Compares every available backend against the python backend, for a grid of points and a
+    few orbits with several different values of z0 and power, and compares the pow of every
+    backend against python's pow for the same grid
+
+    Returns the number of differences found for each backend (which should all be 0)
+    """
+    grid = np.empty((size, size), dtype=np.complex128)
+    grid.real = np.linspace(-2.2, 2.2, size)
+    grid.imag = np.linspace(-2.2, 2.2, size)[:, np.newaxis]
+    orbit_points = grid.ravel()[::size * 7 + 3].tolist()
+
+    reference = PythonBackend()
+    differences = {name: 0 for name in available_backends()}
+    for z0, power in ((complex(0, 0), 2.0), (complex(0, 0), 3.0), (complex(0, 0), 5.0),
+                      (complex(0.25, -0.1), 2.0), (complex(0.1, 0), 2.5),
+                      (complex(0.3, 0.2), -2.0)):
+        expected = reference.escape_counts(grid, z0, power, 2, max_it)
+        expected_orbits = [reference.orbit(c, z0, power, 2, max_it) for c in orbit_points]
+        expected_pow = np.array([pow(c, power) for c in grid.ravel().tolist()]).reshape(grid.shape)
+
+        for name in available_backends():
+            backend = get_backend(name)
+            differences[name] += int(np.sum(backend.escape_counts(grid, z0, power, 2, max_it)
+                                            != expected))
+            for c, expected_orbit in zip(orbit_points, expected_orbits):
+                orbit = backend.orbit(c, z0, power, 2, max_it)
+                if len(orbit) != len(expected_orbit) or np.any(orbit != expected_orbit):
+                    differences[name] += 1
+
+            pow_re, pow_im = backend.pow(grid.real, grid.imag, power)
+            differences[name] += int(np.sum((pow_re != expected_pow.real) |
+                                            (pow_im != expected_pow.imag)))
+
+    return differences
+
+
+if __name__ == '__main__':
+    for backend_name, count in check_backends().items():
+        print(backend_name, 'OK' if count == 0 else str(count) + ' differences')
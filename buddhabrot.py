@@ -0,0 +1,218 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the Buddhabrot (orbit density) renderer.
+
+Rather than colouring each point by how quickly it diverges, a Buddhabrot image counts how often
+the orbits of many randomly chosen divergent points pass through each pixel. The orbits are
+iterated in batches with NumPy, each process in a pool fills its own histogram, and the histograms
+are added together as they finish so the image can be shown as it builds up.
+
+With importance sampling, the points are chosen more often near the boundary of the set, where the
+long orbits that make up most of the image start. Each visit is weighted so the expected image is
+the same as with uniform sampling, but far fewer samples are needed for a smooth image.
+"""
+import math
+import os
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from backends import get_backend, process_pool
+from mandelbrot import escape_counts
+
+BUDDHA_MAX_IT = 1000
+BUDDHA_MIN_IT = 20
+BATCH = 50000
+VISITS = 2 ** 20  # The most visited pixels held before they are added to the histogram
+TASKS_PER_WORKER = 4
+
+
+def importance_map(z0: complex, power: float, valid_radius: float, cells: int = 256,
+                   probes: int = 4, max_it: int = BUDDHA_MAX_IT, min_it: int = BUDDHA_MIN_IT,
+                   floor: float = 0.05, seed: int = 0, backend: str = None) -> np.ndarray:
+    """
+    Returns the probability of sampling each cell of a cells x cells grid over the square
+    [-valid_radius, valid_radius] x [-valid_radius, valid_radius]
+
+    Each cell is probed at a few random points, and is weighted by the total length of the probed
+    orbits that would be drawn. A fraction (floor) of the probability is spread evenly over every
+    cell, so that no part of the square is never sampled.
+    """
+    rng = np.random.default_rng(seed)
+    size = 2 * valid_radius / cells
+    corners = -valid_radius + size * np.arange(cells)
+
+    c = np.empty((probes, cells, cells), dtype=np.complex128)
+    c.real = corners[np.newaxis, np.newaxis, :] + size * rng.random((probes, cells, cells))
+    c.imag = corners[np.newaxis, :, np.newaxis] + size * rng.random((probes, cells, cells))
+    counts = escape_counts(c, z0, power, valid_radius, max_it, backend)
+
+    weight = np.where((counts >= min_it) & (counts < max_it), counts, 0).sum(axis=0).ravel()
+    if weight.sum() == 0:
+        return np.full(cells * cells, 1 / (cells * cells))
+    return (1 - floor) * weight / weight.sum() + floor / (cells * cells)
+
+
+def _sample(rng: np.random.Generator, n: int, valid_radius: float,
+            probabilities: np.ndarray) -> tuple:
+    """
+    Returns n random points in the sampling square and the weight of each one
+    """
+    if probabilities is None:
+        c = np.empty(n, dtype=np.complex128)
+        c.real = rng.uniform(-valid_radius, valid_radius, n)
+        c.imag = rng.uniform(-valid_radius, valid_radius, n)
+        return c, np.ones(n)
+
+    k = len(probabilities)
+    cells = int(round(np.sqrt(k)))
+    size = 2 * valid_radius / cells
+    cell = rng.choice(k, size=n, p=probabilities)
+
+    c = np.empty(n, dtype=np.complex128)
+    c.real = -valid_radius + size * (cell % cells + rng.random(n))
+    c.imag = -valid_radius + size * (cell // cells + rng.random(n))
+    return c, 1 / (k * probabilities[cell])
+
+
+def _accumulate(settings: tuple, view: tuple, samples: int, probabilities: np.ndarray,
+                seed) -> np.ndarray:
+    """
+    Samples the given number of points, and returns the weighted histogram of the pixels visited by
+    the orbits of the ones that diverge
+    """
+    z0, power, valid_radius, max_it, min_it, backend = settings
+    complex_pow = get_backend(backend).pow
+    x_min, x_span, y_min, y_span, width, height = view
+    rng = np.random.default_rng(seed)
+    hist = np.zeros(width * height)
+    pixels = np.empty(VISITS, dtype=np.int64)
+    weights = np.empty(VISITS)
+    n = 0
+
+    for start in range(0, samples, BATCH):
+        c, weight = _sample(rng, min(BATCH, samples - start), valid_radius, probabilities)
+        counts = escape_counts(c, z0, power, valid_radius, max_it, backend)
+        keep = (counts >= min_it) & (counts < max_it)
+        if not keep.any():
+            continue
+
+        # Iterate the orbits again, keeping the visited pixels of every point still in its orbit
+        c_re, c_im, weight, counts = c.real[keep], c.imag[keep], weight[keep], counts[keep]
+        z_re = np.full(len(counts), complex(z0).real)
+        z_im = np.full(len(counts), complex(z0).imag)
+        for step in range(int(counts.max())):
+            alive = counts > step
+            if not alive.all():
+                c_re, c_im, weight, counts, z_re, z_im = \
+                    c_re[alive], c_im[alive], weight[alive], counts[alive], z_re[alive], z_im[alive]
+            z_re, z_im = complex_pow(z_re, z_im, power)
+            z_re = z_re + c_re
+            z_im = z_im + c_im
+
+            col = (z_re - x_min) / x_span * width
+            row = (z_im - y_min) / y_span * height
+            inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+            k = int(inside.sum())
+            if n + k > VISITS:
+                # Add the visits so far to the histogram, so the memory used does not grow with
+                # the length of the orbits
+                hist += np.bincount(pixels[:n], weights=weights[:n], minlength=width * height)
+                n = 0
+            pixels[n:n + k] = row[inside].astype(np.int64) * width + col[inside].astype(np.int64)
+            weights[n:n + k] = weight[inside]
+            n += k
+
+    hist += np.bincount(pixels[:n], weights=weights[:n], minlength=width * height)
+    return hist
+
+
+def render_buddhabrot(frac, samples: int = 1000000, width: int = None, height: int = None,
+                      max_it: int = BUDDHA_MAX_IT, min_it: int = BUDDHA_MIN_IT,
+                      importance: bool = True, workers: int = None, seed: int = 0,
+                      progress=None, backend: str = None, stop=None) -> np.ndarray:
+    """
+    Returns the Buddhabrot histogram of the current view of frac, with the given number of sampled
+    points
+
+    Only orbits that diverge after at least min_it (and fewer than max_it) iterations are counted.
+    progress, if given, is called with the fraction of samples done and the histogram so far
+    every time a process finishes a share of the samples. The orbits are iterated by the backend
+    with the given name, or by the fastest available backend if backend is None (see backends.py).
+    stop, if given, is a threading.Event that ends the render early (with the histogram so far)
+    once it is set.
+
+    Preconditions:
+      - frac is a MandelbrotSet (or has its z0, power and valid_radius attributes)
+    """
+    width = frac.get_width() if width is None else width
+    height = frac.get_height() if height is None else height
+    settings = (frac.z0, frac.power, frac.valid_radius, max_it, min_it, backend)
+    view = (frac.x_range.min, frac.x_range.span, frac.y_range.min, frac.y_range.span,
+            width, height)
+
+    probabilities = None
+    if importance:
+        probabilities = importance_map(frac.z0, frac.power, frac.valid_radius,
+                                       max_it=max_it, min_it=min_it, seed=seed, backend=backend)
+
+    # Split the samples into a few shares per process, so every process stays busy and the
+    # progress is updated regularly
+    share = max(1, math.ceil(samples / (TASKS_PER_WORKER * (workers or os.cpu_count() or 1))))
+    shares = [share] * (samples // share)
+    if samples % share:
+        shares.append(samples % share)
+    seeds = np.random.SeedSequence(seed).spawn(len(shares))
+
+    hist = np.zeros(width * height)
+    done = 0
+    with process_pool(workers) as executor:
+        futures = {executor.submit(_accumulate, settings, view, share, probabilities, s): share
+                   for share, s in zip(shares, seeds)}
+        for future in as_completed(futures):
+            hist += future.result()
+            done += futures[future]
+            if progress is not None:
+                progress(done / samples, hist.reshape(height, width))
+            if stop is not None and stop.is_set():
+                for other in futures:
+                    other.cancel()
+                break
+
+    return hist.reshape(height, width)
+
+
+def buddhabrot_colours(hist: np.ndarray) -> np.ndarray:
+    """
+    Returns an array of RGB values for a Buddhabrot histogram, in the colours of the fractal image
+    """
+    peak = hist.max()
+    if peak <= 0:
+        return np.zeros(hist.shape + (3,), dtype=np.uint8)
+
+    value = (255 * np.sqrt(hist / peak)).astype(np.uint8)
+    rgb = np.zeros(hist.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = value
+    rgb[..., 2] = value
+    return rgb
+
+
+if __name__ == '__main__':
+    import sys
+    from PIL import Image
+    from mandelbrot import MandelbrotView
+    from fractal import S_WIDTH, S_HEIGHT
+
+    def save_progress(fraction: float, hist: np.ndarray) -> None:
+        """
+        Saves the image as it builds up and reports how far along it is
+        """
+        Image.fromarray(buddhabrot_colours(hist)).save(sys.argv[1] + '.png')
+        print('%.0f%%' % (100 * fraction))
+
+    # A view of the same area as the explorer's, which needs no display
+    frac = MandelbrotView(width=round(S_WIDTH * 6 / 10), height=S_HEIGHT)
+    render_buddhabrot(frac, int(sys.argv[2]) if len(sys.argv) > 2 else 1000000,
+                      round(S_WIDTH * 6 / 10), S_HEIGHT, progress=save_progress)
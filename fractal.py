@@ -6,8 +6,9 @@ This file contains the base class, Fractal.
 """
 from math_functions import *
 
-from numpy import mean, exp  # These are much faster than what I can write
-from PIL import Image, ImageDraw
+from numpy import exp  # These are much faster than what I can write
+from PIL import Image
+import numpy as np
 import math
 import pyglet
 from graph import *
@@ -25,6 +26,183 @@ except:
 XY_MAX = 10
 MAX_IT = 32
 MAX_PATTERN = 32
+ORBIT_CHUNK = 65536
+
+
+def complex_grid(x_range: DRange, y_range: DRange, width: int, height: int,
+                 x0: int = 0, y0: int = 0, cols: int = None, rows: int = None) -> np.ndarray:
+    """
+    Returns the complex values of a block of pixels of a width x height image, starting at pixel
+    (x0, y0), with the same pixel to complex number mapping used by update_image
+
+    The returned array is indexed [row, column], so it has the same layout as the image
+    """
+    if cols is None:
+        cols = width - x0
+    if rows is None:
+        rows = height - y0
+
+    grid = np.empty((rows, cols), dtype=np.complex128)
+    grid.real = x_range.min + (np.arange(x0, x0 + cols) / width) * x_range.span
+    grid.imag = (y_range.min + (np.arange(y0, y0 + rows) / height) * y_range.span)[:, np.newaxis]
+    return grid
+
+
+def scan_bounds(base_grid, im_buffer: float = 0.0, step: float = 0.05) -> tuple:
+    """
+    Returns the x and y ranges containing every non-divergent point of a fractal, found by
+    checking a grid of points step apart between -XY_MAX and XY_MAX, with im_buffer added on each
+    side
+
+    base_grid is the vectorized base function of the fractal. The ranges always include 0.
+    """
+    values = []
+    v = -XY_MAX
+    while v < XY_MAX:
+        values.append(v)
+        v += step
+    values = np.array(values)
+
+    c = np.empty((len(values), len(values)), dtype=np.complex128)
+    c.real = values[:, np.newaxis]
+    c.imag = values[np.newaxis, :]
+    inside = base_grid(c) >= MAX_IT
+
+    xs = values[inside.any(axis=1)]
+    ys = values[inside.any(axis=0)]
+    x_range = DRange(max(0.0, float(xs.max(initial=0))), min(0.0, float(xs.min(initial=0))))
+    y_range = DRange(max(0.0, float(ys.max(initial=0))), min(0.0, float(ys.min(initial=0))))
+
+    x_range.max += im_buffer
+    x_range.min -= im_buffer
+
+    y_range.max += im_buffer
+    y_range.min -= im_buffer
+
+    x_range.update_span()
+    y_range.update_span()
+    return x_range, y_range
+
+
+def fit_ranges(x_range: DRange, y_range: DRange, width: int, height: int,
+               contain: bool = False) -> None:
+    """
+    Changes one of the ranges (keeping it centered) so that they have the same aspect ratio as a
+    width x height image
+
+    By default the longer range is cut down so the fractal fills the image. If contain is True,
+    the shorter range is widened instead, so the whole of both ranges stays in the image.
+    """
+    xi_scale = x_range.span / y_range.span
+    xy_scale = width / height
+
+    # determine which dimension the diagram needs to be scaled to match the scale of the screen
+    if (xi_scale >= xy_scale) != contain:
+        scale_buffer = (y_range.span * width - x_range.span * height) / (2 * height)
+        x_range.max += scale_buffer
+        x_range.min -= scale_buffer
+    else:
+        scale_buffer = (x_range.span * height - y_range.span * width) / (2 * width)
+        y_range.max += scale_buffer
+        y_range.min -= scale_buffer
+
+    x_range.update_span()
+    y_range.update_span()
+
+
+def symmetric_counts(base_grid, symmetries: list, x_range: DRange, y_range: DRange, width: int,
+                     height: int) -> np.ndarray:
+    """
+    Returns the result of the vectorized base function base_grid for every pixel of a
+    width x height image of the given ranges, only computing one pixel out of each set of pixels
+    that are symmetric under the given symmetries (see symmetric_source)
+
+    A copied pixel can differ from computing it directly only on the boundary of the set,
+    where the rounding of the pixel's coordinates is enough to change the result
+    """
+    c = complex_grid(x_range, y_range, width, height)
+    source = symmetric_source(symmetries, x_range, y_range, width, height)
+    if source is None:
+        return base_grid(c)
+
+    todo = source == np.arange(source.size)
+    counts = np.zeros(source.size, dtype=np.int64)
+    counts[todo] = base_grid(c.ravel()[todo])
+    return counts[source].reshape(height, width)
+
+
+def symmetric_source(symmetries: list, x_range: DRange, y_range: DRange, width: int,
+                     height: int):
+    """
+    Returns, for every pixel of a width x height image of the given ranges, the index (into the
+    flattened image) of the pixel whose value it can be copied from, or None if none of the
+    symmetries map the pixels of the image onto each other
+
+    Each symmetry is a pair (rotation, conjugate) representing the map from c to
+    rotation * conjugate(c) (or rotation * c if conjugate is False). Only the symmetries that map
+    the grid of pixels exactly onto itself are used, so for example a mirror is only used if the
+    real axis lies on a row of pixels (or halfway between two rows).
+
+    Every pixel is mapped to the first pixel of the image among the pixels symmetric to it, so a
+    pixel that maps to itself is one that has to be computed.
+    """
+    dx = x_range.span / width
+    dy = y_range.span / height
+
+    def to_pixel(c: complex) -> tuple:
+        return (c.real - x_range.min) / dx, (c.imag - y_range.min) / dy
+
+    def to_complex(col: float, row: float) -> complex:
+        return complex(x_range.min + col * dx, y_range.min + row * dy)
+
+    maps = []
+    for rotation, conjugate in symmetries:
+        points = []
+        for col, row in ((0, 0), (1, 0), (0, 1)):
+            c = to_complex(col, row)
+            points.append(to_pixel(rotation * (c.conjugate() if conjugate else c)))
+        origin = points[0]
+        affine = [origin[0], origin[1],
+                  points[1][0] - origin[0], points[1][1] - origin[1],
+                  points[2][0] - origin[0], points[2][1] - origin[1]]
+        if any(abs(value - round(value)) > 1e-6 for value in affine):
+            continue
+
+        col0, row0, col_col, row_col, col_row, row_row = (round(value) for value in affine)
+        if abs(col_col * row_row - col_row * row_col) == 1 and \
+                (col0, row0, col_col, row_col, col_row, row_row) != (0, 0, 1, 0, 0, 1):
+            maps.append((col0, row0, col_col, row_col, col_row, row_row))
+
+    if not maps:
+        return None
+
+    rows, cols = np.indices((height, width))
+    source = np.arange(width * height).reshape(height, width)
+    for col0, row0, col_col, row_col, col_row, row_row in maps:
+        col = col0 + col_col * cols + col_row * rows
+        row = row0 + row_col * cols + row_row * rows
+        inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+        source = np.where(inside, np.minimum(source, row * width + col), source)
+
+    if np.all(source.ravel() == np.arange(width * height)):
+        return None
+    return source.ravel()
+
+
+def colour_counts(counts: np.ndarray, max_it: int = MAX_IT) -> np.ndarray:
+    """
+    Returns an array of RGB values for an array of iteration counts, coloured in the same way as
+    the original fractal image
+    """
+    lut = np.zeros((max_it + 1, 3), dtype=np.uint8)
+    for n in range(max_it + 1):
+        rgb_scale = int(n * 255 / max_it)
+        if rgb_scale > 0:
+            rgb = 255 - int(-255 * math.log(rgb_scale, 1 / 255))
+        else:
+            rgb = 255
+        lut[n] = (rgb, 0, rgb)
+    return lut[np.clip(counts, 0, max_it)]
 
 
 class Fractal:
@@ -67,58 +245,118 @@ class Fractal:
         """
         pass
 
+    def base_grid(self, c: np.ndarray, n: int = MAX_IT) -> np.ndarray:
+        """
+        Returns the result of the base function for every element of an array of complex numbers
+
+        This is made to be overloaded with a vectorized version of the base function, as calling
+        base once per pixel is very slow
+        """
+        return np.vectorize(self.base, otypes=[np.int64])(c, n)
+
+    def symmetries(self) -> list:
+        """
+        Returns the symmetries of the fractal as (rotation, conjugate) pairs, each representing
+        the map from c to rotation * conjugate(c) (or rotation * c if conjugate is False) that
+        leaves the result of the base function unchanged
+
+        This is made to be overloaded by fractals with symmetries
+        """
+        return []
+
+    def symmetric_base_grid(self, x_range: DRange, y_range: DRange, width: int, height: int,
+                            n: int = MAX_IT) -> np.ndarray:
+        """
+        Returns the result of the base function for every pixel of a width x height image of the
+        given ranges, only computing one pixel out of each set of pixels that are symmetric
+        """
+        return symmetric_counts(lambda c: self.base_grid(c, n), self.symmetries(),
+                                x_range, y_range, width, height)
+
+    def orbit_chunks(self, c: complex, n: int = MAX_IT, chunk: int = ORBIT_CHUNK):
+        """
+        Yields the sequence of iterations given by the point function in chunks of at most chunk
+        points
+
+        This is made to be overloaded with a version that never builds the whole sequence, so that
+        very long sequences can be read in constant memory
+        """
+        sequence = self.point(c, n)
+        for i in range(0, len(sequence), chunk):
+            yield np.array(sequence[i:i + chunk], dtype=np.complex128)
+
+    def _distance_chunks(self, c: complex, n: int, m: int):
+        """
+        Yields, in chunks, the distances between each of the first m + 1 consecutive points of the
+        sequence generated at c
+        """
+        previous = None
+        i = 0
+        for chunk in self.orbit_chunks(c, n):
+            if previous is not None:
+                chunk = np.concatenate(([previous], chunk))
+            previous = chunk[-1]
+            step = np.diff(chunk)[:m - i]
+            d_seq = np.sqrt(np.abs(step.real) ** 2 + np.abs(step.imag) ** 2)
+            yield d_seq
+            i += len(d_seq)
+            if i >= m:
+                return
+
+    def classify(self, c: complex, n: int = MAX_IT) -> tuple:
+        """
+        Classifies whether the sequence generated at c is divergent, convergent, cyclic, or
+        chaotic (or undetermined)
+
+        The sequence is read in chunks, and read again for each test that needs it rather than
+        being stored, so the memory used does not grow with n.
+
+        Returns the kind of the sequence, the period of its pattern (0 if it is not cyclic) and
+        the running statistics of the sequence
+        """
+        stats = OrbitStats(MAX_PATTERN)
+        for chunk in self.orbit_chunks(c, n):
+            stats.update(chunk)
+
+        if stats.length < n:
+            return 'divergent', 0, stats
+
+        # The sequence is convergent if every distance between consecutive points is at least the
+        # mean of the distances after it. The sum of each chunk of distances is found first so the
+        # sum of the distances after any point is known as the chunks are read again.
+        m = int(n * (1 - 1 / exp(abs(stats.center()))))
+        chunk_sums = [d_seq.sum() for d_seq in self._distance_chunks(c, n, m)]
+
+        convergent = True
+        i = 0
+        for k, d_seq in enumerate(self._distance_chunks(c, n, m)):
+            later_sum = sum(chunk_sums[k + 1:])
+            after_sum = np.full(len(d_seq), later_sum, dtype=np.float64)
+            after_sum[:-1] += np.cumsum(d_seq[:0:-1])[::-1]
+            after_len = m - 1 - (i + np.arange(len(d_seq)))
+            has_after = after_len > 0
+            if not np.all(d_seq[has_after] >= after_sum[has_after] / after_len[has_after]):
+                convergent = False
+                break
+            i += len(d_seq)
+
+        if convergent:
+            return 'convergent', 0, stats
+
+        pattern = get_pattern(stats.tail())
+        if pattern == [] or len(pattern) == MAX_PATTERN // 4 + 1:
+            return 'chaotic', 0, stats
+        return 'cyclic', len(pattern), stats
+
     def _init_image(self) -> None:
         """
         Generates the initial fractal image used for the background and
         calculates the ranges to accelerate updating the background
         """
 
-        # Determine the x and y range of the fractal
-        x_range = DRange(0, 0)
-        y_range = DRange(0, 0)
-        x = -XY_MAX
-        y = -XY_MAX
-        while x < XY_MAX:
-            while y < XY_MAX:
-                if self.base(complex(x, y)) >= MAX_IT:
-                    if x_range.max <= x:
-                        x_range.max = x
-                    elif x_range.min > x:
-                        x_range.min = x
-                    if y_range.max <= y:
-                        y_range.max = y
-                    elif y_range.min > y:
-                        y_range.min = y
-                y += 0.05
-            y = -XY_MAX
-            x += 0.05
-
-        x_range.max += self.im_buffer
-        x_range.min -= self.im_buffer
-
-        y_range.max += self.im_buffer
-        y_range.min -= self.im_buffer
-
-        x_range.update_span()
-        y_range.update_span()
-
-        xi_scale = x_range.span / y_range.span
-        xy_scale = self._width / self._height
-
-        # determine which dimension the diagram needs to be scaled to match the scale of the screen
-        if xi_scale >= xy_scale:
-            scale_buffer = (y_range.span * self._width - x_range.span * self._height) / \
-                           (2 * self._height)
-            x_range.max += scale_buffer
-            x_range.min -= scale_buffer
-        else:
-            scale_buffer = (x_range.span * self._height - y_range.span * self._width) / \
-                           (2 * self._width)
-            y_range.max += scale_buffer
-            y_range.min -= scale_buffer
-
-        x_range.update_span()
-        y_range.update_span()
+        # Determine the x and y range of the fractal, then match them to the shape of the screen
+        x_range, y_range = scan_bounds(self.base_grid, self.im_buffer)
+        fit_ranges(x_range, y_range, self._width, self._height)
 
         self.x_range = x_range
         self.y_range = y_range
@@ -128,21 +366,8 @@ class Fractal:
         """
         Updates fractal image
         """
-        im = Image.new('RGB', (self._width, self._height), (0, 0, 0))
-        draw = ImageDraw.Draw(im)
-
-        for x in range(0, self._width):
-            for y in range(0, self._height):
-                c = complex(self.x_range.min + (x / self._width) * self.x_range.span,
-                            self.y_range.min + (y / self._height) * self.y_range.span)
-
-                final_n = self.base(c)
-
-                rgb_scale = int(final_n * 255 / MAX_IT)
-                rgb = 255 - int(-255 * math.log(rgb_scale, 1 / 255))
-                draw.point([x, y], (rgb, 0, rgb))
-
-        self.im = im
+        counts = self.symmetric_base_grid(self.x_range, self.y_range, self._width, self._height)
+        self.im = Image.fromarray(colour_counts(counts))
 
     def save_image(self, local_address: str) -> None:
         """
@@ -155,12 +380,16 @@ class Fractal:
         Classifies whether a point (given by clicking on the screen) is
         divergent (not in Mandelbrot set), convergent, cyclic, or chaotic or divergent
         and then draws the points that have been iterated through on the graph
+
+        Only the start of a long sequence is drawn. Returns the description of the orbit and the
+        running statistics of the sequence
         """
         self.clear_batch()
         c = complex(self.x_range.min + (x / self._width) * self.x_range.span,
                     self.y_range.min + (y / self._height) * self.y_range.span)
 
-        sequence = self.point(c, n)  # Iteration sequence
+        kind, period, stats = self.classify(c, n)
+        sequence = stats.head.tolist()  # The start of the iteration sequence, to be drawn
 
         # Use a graph mapping
         graph = Graph()
@@ -173,29 +402,21 @@ class Fractal:
 
             graph.add_edge(cn, (screen_x, screen_y))
 
-        # First determine what kind of sequence was generated
-        center = c
-        if len(sequence) < n:
+        # Describe what kind of sequence was generated
+        if kind == 'divergent':
             orbit = 'TYPE: divergent'
+        elif kind == 'convergent':
+            center = stats.center()
+            orbit = 'TYPE: convergent\n\nCENTER: ' + \
+                    str(complex(round(center.real, 2), round(center.imag, 2)))
+        elif kind == 'chaotic':
+            orbit = 'TYPE: chaotic or undetermined' + \
+                    '\n\nTEST DEPTH: ' + str(n) + \
+                    '\n\nCENTER: ' + str(complex(round(c.real, 2), round(c.imag, 2)))
         else:
-            center = sum(sequence) / len(sequence)
-            d_seq = [complex_distance(sequence[i], sequence[i + 1])
-                     for i in range(int(n * (1 - 1 / exp(abs(center)))))]
-
-            if all([d_seq[i] >= mean(d_seq[i + 1:n]) for i in range(len(d_seq) - 1)]):
-                orbit = 'TYPE: convergent\n\nCENTER: ' + \
-                        str(complex(round(center.real, 2), round(center.imag, 2)))
-            else:
-                pattern = get_pattern([complex(el.real, el.imag) for el in sequence[-MAX_PATTERN:]])
-                if pattern == [] or len(pattern) == MAX_PATTERN // 4 + 1:
-                    orbit = 'TYPE: chaotic or undetermined' + \
-                            '\n\nTEST DEPTH: ' + str(n) + \
-                            '\n\nCENTER: ' + str(complex(round(c.real, 2), round(c.imag, 2)))
-
-                else:
-                    orbit = 'TYPE: cyclic' + \
-                            '\n\nPERIOD: ' + str(len(pattern)) + \
-                            '\n\nCENTER: ' + str(complex(round(c.real, 2), round(c.imag, 2)))
+            orbit = 'TYPE: cyclic' + \
+                    '\n\nPERIOD: ' + str(period) + \
+                    '\n\nCENTER: ' + str(complex(round(c.real, 2), round(c.imag, 2)))
 
         # Then draw the sequence to the screen
         x1, y1 = graph.get_neighbour(sequence[0]).item
@@ -217,7 +438,7 @@ class Fractal:
         self.shapes.append(
             pyglet.shapes.Circle(x, y, radius=5, color=(0, 255, 255), batch=self.batch))
 
-        return orbit, sequence
+        return orbit, stats
 
     def update(self, x: int, y: int, n: int = MAX_IT) -> None:
         """
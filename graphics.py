@@ -6,6 +6,9 @@ This file contains graphical objects used in displaying information with pyglet.
 """
 
 import pyglet
+import numpy as np
+
+from math_functions import OrbitStats
 
 
 class Button:
@@ -145,20 +148,27 @@ class CyclicGraph:
         self.p1 = p1
         self.p2 = p2
 
-    def update(self, sequence: list) -> None:
+    def update(self, sequence) -> None:
         """
-        Update the cycle-graph given a new sequence
+        Update the cycle-graph given a new sequence, either as a list or as the running statistics
+        of a (possibly very long) sequence
         """
         self.clear_batch()
-        sequence = [abs(c) for c in sequence]
-        c_max = max(sequence)
-        c_min = min(sequence)
+        if not isinstance(sequence, OrbitStats):
+            stats = OrbitStats()
+            stats.update(np.array(sequence, dtype=np.complex128))
+            sequence = stats
+
+        c_max = sequence.abs_max
+        c_min = sequence.abs_min
+        length = sequence.length
+        sequence = [abs(c) for c in sequence.head[:self.n_points]]
 
         available_width = self.width
 
         # In case the sequence is divergent and has less than n_points elements
-        if len(sequence) < self.n_points:
-            n_points = len(sequence)
+        if length < self.n_points:
+            n_points = length
         else:
             n_points = self.n_points
 
@@ -183,11 +193,6 @@ class CyclicGraph:
                                                     radius=3,
                                                     batch=self.batch))
 
-        if isinstance(sequence, list):
-            pass
-        else:  # Graph -- cyclic
-            pass
-
     def clear_batch(self) -> None:
         """Clears the batch, removing the cycle-graph from the screen"""
         self.shapes = []
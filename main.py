@@ -9,54 +9,91 @@ This is the main file of the project. Running this file will setup and start the
 from mandelbrot import MandelbrotSet
 from fractal import S_WIDTH, S_HEIGHT
 from graphics import *
+from renderer import BackgroundRenderer, BuddhabrotRenderer, ZOOM
 
 #############################################################################
 # SETUP
 #############################################################################
 
-frac_w = round(S_WIDTH * 6 / 10)
-frac = MandelbrotSet(frac_w)
-frac.im_buffer = 0.2
-frac.save_image('fractal_image')
-
-info = PropertiesBox((frac_w, round(S_HEIGHT * 8 / 10)), (S_WIDTH, S_HEIGHT))
-
-c_graph = CyclicGraph((frac_w, round(S_HEIGHT * 2 / 10)), (S_WIDTH, round(S_HEIGHT * 8 / 10)))
-
-buttons = []
-buttons.append(Button(c_graph.decrease_disp_cycles,
-                      (S_WIDTH - 45, round(S_HEIGHT * 2 / 10) - 25),
-                      (S_WIDTH - 20, round(S_HEIGHT * 2 / 10)),
-                      '+'))
-buttons.append(Button(c_graph.increase_disp_cycles,
-                      (S_WIDTH - 70 - 5, round(S_HEIGHT * 2 / 10) - 20),
-                      (S_WIDTH - 45 - 5, round(S_HEIGHT * 2 / 10)),
-                      '-'))
-
-pic = pyglet.image.load('fractal_image.png')
-pic.anchor_y = frac.get_height()
-
-window = pyglet.window.Window(fullscreen=True)
-
-current_seq = [1]
-
-name = pyglet.text.Label('Exploring Orbitals in Iterative Fractals' +
-                         '\nFinn Williams' +
-                         '\n2021/04/16',
-                         bold=False,
-                         x=S_WIDTH,
-                         y=round(S_HEIGHT * 2 / 10 - 30) // 2,
-                         align='center',
-                         anchor_x='right', anchor_y='center',
-                         multiline=True,
-                         width=S_WIDTH - frac_w)
+# The processes that render Buddhabrot images import this file again, so the application is
+# only set up and started when this file is run
+if __name__ == '__main__':
+    frac_w = round(S_WIDTH * 6 / 10)
+    frac = MandelbrotSet(frac_w)
+    frac.im_buffer = 0.2
+    frac.save_image('fractal_image')
+
+    info = PropertiesBox((frac_w, round(S_HEIGHT * 8 / 10)), (S_WIDTH, S_HEIGHT))
+
+    c_graph = CyclicGraph((frac_w, round(S_HEIGHT * 2 / 10)), (S_WIDTH, round(S_HEIGHT * 8 / 10)))
+
+    buttons = []
+    buttons.append(Button(c_graph.decrease_disp_cycles,
+                          (S_WIDTH - 45, round(S_HEIGHT * 2 / 10) - 25),
+                          (S_WIDTH - 20, round(S_HEIGHT * 2 / 10)),
+                          '+'))
+    buttons.append(Button(c_graph.increase_disp_cycles,
+                          (S_WIDTH - 70 - 5, round(S_HEIGHT * 2 / 10) - 20),
+                          (S_WIDTH - 45 - 5, round(S_HEIGHT * 2 / 10)),
+                          '-'))
+
+    # The first row of the fractal image (the smallest imaginary part) goes at the bottom of the
+    # screen, matching the coordinates used when clicking on the fractal
+    pic = pyglet.image.ImageData(frac.get_width(), frac.get_height(), 'RGB', frac.im.tobytes(),
+                                 pitch=3 * frac.get_width())
+    pic.anchor_y = frac.get_height()
+
+    window = pyglet.window.Window(fullscreen=True)
+
+    renderer = BackgroundRenderer(frac, on_render)
+    buddha = BuddhabrotRenderer(frac, on_render)
+    active = renderer  # The renderer of the image being shown
+
+    current_seq = [1]
+
+    name = pyglet.text.Label('Exploring Orbitals in Iterative Fractals' +
+                             '\nFinn Williams' +
+                             '\n2021/04/16',
+                             bold=False,
+                             x=S_WIDTH,
+                             y=round(S_HEIGHT * 2 / 10 - 30) // 2,
+                             align='center',
+                             anchor_x='right', anchor_y='center',
+                             multiline=True,
+                             width=S_WIDTH - frac_w)
+
+
+def on_render(job, image) -> None:
+    """
+    Swap in a newly rendered fractal image (or the latest stage of a Buddhabrot image), along with
+    the ranges and power it was rendered with
+    """
+    global pic
+    image.anchor_y = frac.get_height()
+    pic = image
+    if job.x_range is not frac.x_range or job.y_range is not frac.y_range or \
+            job.power != frac.power:
+        frac.x_range = job.x_range
+        frac.y_range = job.y_range
+        frac.power = job.power
+        frac.clear_batch()
+
+
+def switch_mode() -> None:
+    """
+    Switch between the escape time image and the Buddhabrot image of the current view
+    """
+    global active
+    new = buddha if active is renderer else renderer
+    active.cancel()
+    new.request(active.x_range, active.y_range, active.power)
+    active = new
 
 
 #############################################################################
 # RUNTIME LOOP
 #############################################################################
 
-@window.event
 def on_draw() -> None:
     """
     What to do everytime .draw() is called...
@@ -77,16 +114,24 @@ def on_draw() -> None:
         b.batch.draw()
 
 
-@window.event
 def on_key_press(symbol, modifiers) -> None:
     """
     If the escape key is pressed, close the window
+    If the up or down key is pressed, re-render the fractal with a higher or lower power
+    If the B key is pressed, switch between the escape time and Buddhabrot images
     """
     if symbol == pyglet.window.key.ESCAPE:
+        renderer.close()
+        buddha.close()
         window.close()
+    elif symbol == pyglet.window.key.UP:
+        active.rerender(active.power + 1)
+    elif symbol == pyglet.window.key.DOWN and active.power > 2:
+        active.rerender(active.power - 1)
+    elif symbol == pyglet.window.key.B:
+        switch_mode()
 
 
-@window.event
 def on_mouse_release(x, y, button, modifiers) -> None:
     """
     When the mouse is released, call the update point function at the location of release
@@ -110,7 +155,6 @@ def on_mouse_release(x, y, button, modifiers) -> None:
     frac.batch.draw()
 
 
-@window.event
 def on_mouse_drag(x, y, dx, dy, button, modifiers) -> None:
     """
     Continuously update the iteration drawing the the mouse is dragged around the fractal graph
@@ -124,6 +168,16 @@ def on_mouse_drag(x, y, dx, dy, button, modifiers) -> None:
             frac.batch.draw()
 
 
+def on_mouse_scroll(x, y, scroll_x, scroll_y) -> None:
+    """
+    Zoom the fractal image in or out around the mouse, re-rendering it in the background
+    """
+    if x < frac.get_width():
+        active.zoom(x, y, ZOOM ** scroll_y)
+
+
 # Begin the runtime loop
-event_loop = pyglet.app.EventLoop()
-pyglet.app.run()
+if __name__ == '__main__':
+    window.push_handlers(on_draw, on_key_press, on_mouse_release, on_mouse_drag, on_mouse_scroll)
+    event_loop = pyglet.app.EventLoop()
+    pyglet.app.run()
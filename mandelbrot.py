@@ -2,10 +2,50 @@
 Finn Williams
 2021/04/16
 
-This file contains the derivative class, MandelbrotSet.
+This file contains the derivative class, MandelbrotSet, and MandelbrotView, which holds the same
+parameters and view for rendering without a window.
 """
 from fractal import Fractal
-from fractal import MAX_IT
+from fractal import MAX_IT, ORBIT_CHUNK, fit_ranges, scan_bounds
+from backends import get_backend
+from math_functions import DRange
+
+import cmath
+import math
+import numpy as np
+
+
+def escape_counts(c: np.ndarray, z0: complex = complex(0, 0), power: float = 2.0,
+                  valid_radius: float = 2, max_it: int = MAX_IT,
+                  backend: str = None) -> np.ndarray:
+    """
+    A vectorized version of MandelbrotSet.base, returning the number of iterations before each
+    element of c becomes divergent
+
+    The iterations are done by the backend with the given name, or by the fastest available
+    backend if backend is None (see backends.py).
+    """
+    return get_backend(backend).escape_counts(c, z0, power, valid_radius, max_it)
+
+
+def mandelbrot_symmetries(z0: complex, power: float) -> list:
+    """
+    Returns the symmetries of the Mandelbrot set (or one of its derivatives) with the given z0
+    and power, as (rotation, conjugate) pairs (see Fractal.symmetries)
+
+    If z0 is real, the set is mirrored in the real axis. If z0 is 0 and the power d is an
+    integer, the set is also unchanged by rotations of 1 / (d - 1) of a turn.
+    """
+    rotations = [complex(1, 0)]
+    if z0 == 0 and power == int(power) and power > 2:
+        k = int(power) - 1
+        rotations = [cmath.exp(2j * math.pi * j / k) for j in range(k)]
+        rotations = [complex(round(r.real, 12), round(r.imag, 12)) for r in rotations]
+
+    symmetries = [(rotation, False) for rotation in rotations[1:]]
+    if complex(z0).imag == 0:
+        symmetries += [(rotation, True) for rotation in rotations]
+    return symmetries
 
 
 class MandelbrotSet(Fractal):
@@ -16,12 +56,15 @@ class MandelbrotSet(Fractal):
       - z0: initial iteration value
       - power: the power to raise each iteration to
       - valid_radius: the radius outside of which an iteration is considered divergent
+      - backend: the backend used for the vectorized and streamed iterations (see backends.py)
     """
 
-    def __init__(self, width: int, z0: complex = complex(0, 0), power: float = 2.0):
+    def __init__(self, width: int, z0: complex = complex(0, 0), power: float = 2.0,
+                 backend: str = None):
         self.z0 = z0
         self.power = power
         self.valid_radius = 2
+        self.backend = get_backend(backend)
         Fractal.__init__(self, width)
         self.im_buffer = 0.2
         self._init_image()
@@ -41,6 +84,18 @@ class MandelbrotSet(Fractal):
             n += 1
         return n
 
+    def base_grid(self, c: np.ndarray, max_it: int = MAX_IT) -> np.ndarray:
+        """
+        The vectorized base function, used to generate whole images at once
+        """
+        return self.backend.escape_counts(c, self.z0, self.power, self.valid_radius, max_it)
+
+    def symmetries(self) -> list:
+        """
+        Returns the symmetries of the set (see mandelbrot_symmetries)
+        """
+        return mandelbrot_symmetries(self.z0, self.power)
+
     def point(self, c, max_it=MAX_IT) -> list[complex]:
         """
         Similar to the base function but returns the entire sequence of iterations for further
@@ -52,3 +107,51 @@ class MandelbrotSet(Fractal):
             z = pow(z, self.power) + c
             sequence.append(z)
         return sequence
+
+    def orbit_chunks(self, c, max_it=MAX_IT, chunk=ORBIT_CHUNK):
+        """
+        Similar to the point function but yields the sequence in chunks, written into a single
+        preallocated complex128 array, so that very long sequences use constant memory
+
+        The same array is reused for every chunk, so a chunk must be copied if it is to be kept
+        """
+        buffer = np.empty(max(1, min(chunk, max_it)), dtype=np.complex128)
+        z = self.z0
+        remaining = max_it
+        while remaining > 0:
+            size = min(len(buffer), remaining)
+            i, z = self.backend.orbit_into(buffer[:size], z, c, self.power, self.valid_radius)
+            if i > 0:
+                yield buffer[:i]
+            if i < size:  # The sequence diverged
+                return
+            remaining -= i
+
+
+class MandelbrotView:
+    """
+    The parameters and view of the Mandelbrot set (or one of its derivatives), for rendering it
+    without a window (see poster.py and buddhabrot.py), since a MandelbrotSet needs a display
+
+    Instance Attributes:
+      - z0: initial iteration value
+      - power: the power to raise each iteration to
+      - valid_radius: the radius outside of which an iteration is considered divergent
+      - x_range: the range of the view along the real axis
+      - y_range: the range of the view along the imaginary axis
+    """
+
+    def __init__(self, z0: complex = complex(0, 0), power: float = 2.0, x_range: DRange = None,
+                 y_range: DRange = None, width: int = None, height: int = None):
+        self.z0 = z0
+        self.power = power
+        self.valid_radius = 2
+
+        if x_range is None or y_range is None:
+            # Use the ranges a new MandelbrotSet would start with, fitted to width x height
+            x_range, y_range = scan_bounds(
+                lambda c: escape_counts(c, z0, power, self.valid_radius, MAX_IT), 0.2)
+            if width is not None and height is not None:
+                fit_ranges(x_range, y_range, width, height)
+        self.x_range = x_range
+        self.y_range = y_range
@@ -5,6 +5,7 @@ Finn Williams
 This file contains mathematical helper functions and classes.
 """
 import math
+import numpy as np
 
 
 def complex_distance(c1, c2) -> float:
@@ -63,6 +64,60 @@ def get_pattern(seq: list, acc: float = 0.00025) -> list:
     return []
 
 
+def pattern_lengths(seqs: np.ndarray, acc: float = 0.00025, block: int = 4096) -> np.ndarray:
+    """
+    Returns the length of the pattern get_pattern finds in each row of seqs (0 if it finds none)
+
+    Each pair of points in a row is compared once, and the comparisons that get_pattern makes are
+    looked up for every row at once, so the result is exactly the same as calling get_pattern on
+    each row. The rows are handled block rows at a time to limit the memory used.
+    """
+    if len(seqs) > block:
+        return np.concatenate([pattern_lengths(seqs[i:i + block], acc, block)
+                               for i in range(0, len(seqs), block)])
+
+    rows, length = seqs.shape
+    result = np.zeros(rows, dtype=np.int64)
+    if rows == 0:
+        return result
+
+    diff = seqs[:, :, np.newaxis] - seqs[:, np.newaxis, :]
+    close = acc > np.hypot(diff.real, diff.imag)
+    equal = diff == 0
+
+    s_range = int(round(length / 2))
+    todo = np.arange(rows)
+    for a in range(1, s_range):
+        repeats = int(s_range / a - 1)
+        sub_len = a * repeats
+        lst_len = length - a
+        starts = np.arange(length - a)
+
+        # lst_index[b, j] is the position in seq of lst[j] when the pattern starts at b, and
+        # sub_index[b, n] is the position of sub[n]
+        j = np.arange(lst_len)
+        lst_index = np.where(j < starts[:, np.newaxis], j, j + a)
+        sub_index = starts[:, np.newaxis] + np.arange(sub_len) % a
+
+        if sub_len == lst_len:  # is_sublist only returns True if the lists are equal
+            found = equal[todo[:, np.newaxis, np.newaxis], lst_index, sub_index].all(axis=2)
+        elif sub_len > lst_len:
+            found = np.zeros((todo.size, len(starts)), dtype=bool)
+        else:
+            windows = lst_index[:, np.arange(lst_len - sub_len)[:, np.newaxis] +
+                                np.arange(sub_len)]
+            found = close[todo[:, np.newaxis, np.newaxis, np.newaxis], windows,
+                          sub_index[:, np.newaxis, :]].all(axis=3).any(axis=2)
+
+        matched = found.any(axis=1)
+        result[todo[matched]] = a
+        todo = todo[~matched]
+        if todo.size == 0:
+            break
+
+    return result
+
+
 class DRange:
     """
     Represents a range on a number line
@@ -87,3 +142,74 @@ class DRange:
         Updates self.span to match possible new values of self.max and self.min
         """
         self.span = self.max - self.min
+
+
+class OrbitStats:
+    """
+    Running statistics of an iteration sequence that is read in chunks, so that sequences much
+    longer than memory allows can still be classified and drawn
+
+    Instance Attributes:
+      - length: the number of points that have been read
+      - total: the sum of all points that have been read
+      - abs_min: the smallest absolute value of the points that have been read
+      - abs_max: the largest absolute value of the points that have been read
+      - head: the first (at most head_size) points of the sequence
+      - window: a ring buffer holding the last (at most window_size) points of the sequence
+
+    Representation Invariants:
+      - length >= 0
+      - 0 <= _pos < len(window)
+    """
+
+    def __init__(self, window_size: int = 32, head_size: int = 512):
+        self.length = 0
+        self.total = complex(0, 0)
+        self.abs_min = math.inf
+        self.abs_max = -math.inf
+
+        self.head = np.empty(0, dtype=np.complex128)
+        self._head_size = head_size
+
+        self.window = np.zeros(window_size, dtype=np.complex128)
+        self._pos = 0  # index of the oldest point in the window once it is full
+
+    def update(self, chunk: np.ndarray) -> None:
+        """
+        Adds the next chunk of the sequence to the statistics
+        """
+        k = len(chunk)
+        if k == 0:
+            return
+
+        self.total += complex(chunk.sum())
+        magnitude = np.abs(chunk)
+        self.abs_min = min(self.abs_min, float(magnitude.min()))
+        self.abs_max = max(self.abs_max, float(magnitude.max()))
+
+        if len(self.head) < self._head_size:
+            self.head = np.concatenate((self.head, chunk[:self._head_size - len(self.head)]))
+
+        size = len(self.window)
+        if k >= size:
+            self.window[:] = chunk[k - size:]
+            self._pos = 0
+        else:
+            self.window[(self._pos + np.arange(k)) % size] = chunk
+            self._pos = (self._pos + k) % size
+
+        self.length += k
+
+    def center(self) -> complex:
+        """
+        Returns the mean of all points that have been read
+        """
+        return self.total / self.length
+
+    def tail(self) -> list:
+        """
+        Returns the last (at most window_size) points of the sequence, oldest first
+        """
+        if self.length < len(self.window):
+            return self.window[:self.length].tolist()
+        return np.roll(self.window, -self._pos).tolist()
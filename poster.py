@@ -0,0 +1,163 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the poster renderer, used to render fractal images that are far larger than
+memory (for example, a 64k x 64k print).
+
+The iteration counts are computed in tiles by a pool of processes and written to a memory-mapped
+file on disk, then the final PNG is encoded strip by strip from that file. A record of which tiles
+are finished is kept next to the counts, so a render that was interrupted can be resumed by calling
+render_poster again with the same arguments.
+"""
+import json
+import os
+import struct
+import zlib
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from backends import process_pool
+from fractal import MAX_IT, complex_grid, colour_counts
+from mandelbrot import escape_counts
+from math_functions import DRange
+
+TILE = 1024
+
+
+def _render_tile(counts_address: str, shape: tuple, x0: int, y0: int, tile: int,
+                 settings: dict) -> tuple:
+    """
+    Computes the iteration counts of one tile and writes them into the memory-mapped counts file
+
+    Returns the position of the tile so that it can be marked as finished
+    """
+    height, width = shape
+    cols = min(tile, width - x0)
+    rows = min(tile, height - y0)
+
+    c = complex_grid(DRange(*settings['x_range']), DRange(*settings['y_range']),
+                     width, height, x0, y0, cols, rows)
+    counts = np.memmap(counts_address, dtype=np.uint32, mode='r+', shape=shape)
+    counts[y0:y0 + rows, x0:x0 + cols] = escape_counts(c, complex(*settings['z0']),
+                                                       settings['power'],
+                                                       settings['valid_radius'],
+                                                       settings['max_it'])
+    counts.flush()
+    del counts
+    return x0 // tile, y0 // tile
+
+
+def _write_chunk(file, kind: bytes, data: bytes) -> None:
+    """
+    Writes a single PNG chunk to the given file
+    """
+    file.write(struct.pack('>I', len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+def write_png(counts: np.ndarray, local_address: str, max_it: int = MAX_IT,
+              strip: int = None) -> None:
+    """
+    Colours an array of iteration counts and saves it as a PNG at the given local address
+
+    The image is coloured, filtered and compressed a strip of rows at a time, so counts can be a
+    memory-mapped array much larger than memory. By default each strip holds about as many pixels
+    as one tile.
+    """
+    height, width = counts.shape
+    if strip is None:
+        strip = max(1, TILE * TILE // width)
+
+    with open(local_address + '.png', 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        _write_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+        compressor = zlib.compressobj()
+        for y in range(0, height, strip):
+            rgb = colour_counts(counts[y:y + strip], max_it)
+            rows = np.zeros((rgb.shape[0], 3 * width + 1), dtype=np.uint8)  # filter byte is 0
+            rows[:, 1:] = rgb.reshape(rgb.shape[0], 3 * width)
+            data = compressor.compress(rows.tobytes())
+            if data:
+                _write_chunk(file, b'IDAT', data)
+        _write_chunk(file, b'IDAT', compressor.flush())
+        _write_chunk(file, b'IEND', b'')
+
+
+def render_poster(frac, local_address: str, width: int, height: int = None,
+                  max_it: int = MAX_IT, tile: int = TILE, workers: int = None,
+                  keep_counts: bool = False) -> None:
+    """
+    Renders the current view of frac at the given size and saves it as a PNG at the given local
+    address
+
+    If height is not given, it is chosen to keep the aspect ratio of the fractal's ranges. The
+    iteration counts are kept in local_address + '.counts' while rendering, and are deleted once
+    the image is saved unless keep_counts is True.
+
+    Preconditions:
+      - frac is a MandelbrotSet or a MandelbrotView (or has their z0, power, valid_radius,
+        x_range and y_range attributes)
+      - width > 0 and tile > 0
+    """
+    if height is None:
+        height = max(1, round(width * frac.y_range.span / frac.x_range.span))
+    shape = (height, width)
+    n_tiles = (-(-height // tile), -(-width // tile))
+
+    settings = {'width': width, 'height': height, 'tile': tile, 'max_it': max_it,
+                'z0': [complex(frac.z0).real, complex(frac.z0).imag],
+                'power': frac.power, 'valid_radius': frac.valid_radius,
+                'x_range': [frac.x_range.max, frac.x_range.min],
+                'y_range': [frac.y_range.max, frac.y_range.min]}
+
+    counts_address = local_address + '.counts'
+    tiles_address = local_address + '.tiles'
+    settings_address = local_address + '.json'
+
+    # Resume a previous render only if it was started with exactly the same settings
+    resume = False
+    if all(os.path.exists(a) for a in (counts_address, tiles_address, settings_address)):
+        with open(settings_address) as file:
+            resume = json.load(file) == settings
+
+    if resume:
+        counts = np.memmap(counts_address, dtype=np.uint32, mode='r+', shape=shape)
+        done = np.memmap(tiles_address, dtype=np.uint8, mode='r+', shape=n_tiles)
+    else:
+        counts = np.memmap(counts_address, dtype=np.uint32, mode='w+', shape=shape)
+        done = np.memmap(tiles_address, dtype=np.uint8, mode='w+', shape=n_tiles)
+        done.flush()
+        with open(settings_address, 'w') as file:
+            json.dump(settings, file)
+
+    # The tiles are only marked as finished once their counts have been flushed to disk
+    with process_pool(workers) as executor:
+        futures = [executor.submit(_render_tile, counts_address, shape, tx * tile, ty * tile,
+                                   tile, settings)
+                   for ty in range(n_tiles[0]) for tx in range(n_tiles[1]) if not done[ty, tx]]
+        for future in as_completed(futures):
+            tx, ty = future.result()
+            done[ty, tx] = 1
+            done.flush()
+
+    write_png(counts, local_address, max_it)
+
+    del counts, done
+    if not keep_counts:
+        for address in (counts_address, tiles_address, settings_address):
+            os.remove(address)
+
+
+if __name__ == '__main__':
+    import sys
+    from mandelbrot import MandelbrotView
+    from fractal import S_WIDTH, S_HEIGHT
+
+    # The view the explorer starts with, found without opening a window
+    view = MandelbrotView(width=round(S_WIDTH * 6 / 10), height=S_HEIGHT)
+    render_poster(view, sys.argv[1], int(sys.argv[2]))
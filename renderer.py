@@ -0,0 +1,299 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the background renderer, used to re-render the fractal image (after zooming or
+changing the power, for example) without freezing the pyglet window.
+
+Each render is split into strips of rows that are computed by a pool of worker threads, after a
+first task finds the pixels that are copied by symmetry. Finished renders are passed back to the
+pyglet event loop, which checks for them on every clock tick. A new render request cancels any
+render still in progress, so only the latest image is ever shown.
+
+Each render works on its own copy of the fractal, so changing the power only changes the fractal
+being explored once the image with the new power is shown.
+
+The Buddhabrot renderer works in the same way, but renders a Buddhabrot image of the view (see
+buddhabrot.py) and hands over every stage of the image as it builds up.
+"""
+import copy
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyglet
+
+from buddhabrot import buddhabrot_colours, render_buddhabrot
+from fractal import Fractal, MAX_IT, complex_grid, colour_counts, symmetric_source
+from math_functions import DRange
+
+STRIP = 32
+ZOOM = 0.8
+
+
+class RenderJob:
+    """
+    A single request to render the fractal image
+
+    Instance Attributes:
+      - frac: a copy of the fractal being rendered, with the power of this render
+      - x_range: the range of the image along the real axis
+      - y_range: the range of the image along the imaginary axis
+      - power: the power of the image
+      - counts: the iteration counts of the image, filled in strip by strip
+      - source: the pixel each pixel is copied from by symmetry, or None (see symmetric_source),
+        found by the first task of the render
+      - rgb: the coloured image, once every strip is finished (or the latest stage of a
+        Buddhabrot image)
+      - cancelled: whether a newer request has replaced this one
+    """
+
+    def __init__(self, frac: Fractal, x_range: DRange, y_range: DRange, power: float,
+                 width: int, height: int):
+        self.frac = copy.copy(frac)
+        self.frac.power = power
+        self.x_range = x_range
+        self.y_range = y_range
+        self.power = power
+        self.width = width
+        self.height = height
+
+        self.counts = np.zeros((height, width), dtype=np.int64)
+        self.source = None
+        self.rgb = None
+        self.cancelled = False
+
+        self.futures = []
+        self.remaining = -(-height // STRIP)
+        self.lock = threading.Lock()
+
+
+class BackgroundRenderer:
+    """
+    Renders images of a fractal in worker threads and hands them to the pyglet event loop
+
+    on_done is called on the event loop thread with the RenderJob and a pyglet image of each
+    finished render (or each stage of a render, for subclasses that show the image building up),
+    with the first row of the render (the smallest imaginary part) at the bottom, so that it
+    matches the screen coordinates used by Fractal.update_point.
+
+    Instance Attributes:
+      - frac: the fractal being rendered
+      - on_done: the function called with each finished render
+      - x_range: the range along the real axis of the latest requested render
+      - y_range: the range along the imaginary axis of the latest requested render
+      - power: the power of the latest requested render
+
+    Representation Invariants:
+      - frac has a power attribute (like MandelbrotSet)
+    """
+
+    def __init__(self, frac: Fractal, on_done, workers: int = None, interval: float = 1 / 60):
+        self.frac = frac
+        self.on_done = on_done
+        self.x_range = frac.x_range
+        self.y_range = frac.y_range
+        self.power = frac.power
+
+        if workers is None and getattr(getattr(frac, 'backend', None), 'parallel', False):
+            workers = 1  # Each call of the backend already uses every core
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._finished = queue.Queue()
+        self._job = None
+
+        pyglet.clock.schedule_interval(self._poll, interval)
+
+    def request(self, x_range: DRange, y_range: DRange, power: float = None) -> None:
+        """
+        Starts rendering the fractal over the given ranges with the given power (or the power of
+        the latest requested render), cancelling any render in progress
+        """
+        self.cancel()
+        self.x_range = x_range
+        self.y_range = y_range
+        if power is not None:
+            self.power = power
+
+        job = RenderJob(self.frac, x_range, y_range, self.power, self.frac.get_width(),
+                        self.frac.get_height())
+        self._job = job
+        job.futures.append(self._executor.submit(self._start, job))
+
+    def rerender(self, power: float = None) -> None:
+        """
+        Renders the latest requested ranges again, with the given power if one is given
+        """
+        self.request(self.x_range, self.y_range, power)
+
+    def zoom(self, x: int, y: int, scale: float) -> None:
+        """
+        Renders the latest requested ranges scaled by scale around the screen point (x, y)
+        """
+        width = self.frac.get_width()
+        height = self.frac.get_height()
+        c = complex(self.x_range.min + (x / width) * self.x_range.span,
+                    self.y_range.min + (y / height) * self.y_range.span)
+
+        x_span = self.x_range.span * scale
+        y_span = self.y_range.span * scale
+        x_min = c.real - (x / width) * x_span
+        y_min = c.imag - (y / height) * y_span
+        self.request(DRange(x_min + x_span, x_min), DRange(y_min + y_span, y_min))
+
+    def cancel(self) -> None:
+        """
+        Cancels the render in progress, if there is one
+        """
+        if self._job is not None:
+            self._job.cancelled = True
+            for future in self._job.futures:
+                future.cancel()
+            self._job = None
+
+    def busy(self) -> bool:
+        """
+        Returns whether a render is in progress
+        """
+        return self._job is not None
+
+    def close(self) -> None:
+        """
+        Cancels the render in progress and stops the worker threads
+        """
+        self.cancel()
+        pyglet.clock.unschedule(self._poll)
+        self._executor.shutdown(wait=False)
+
+    def _start(self, job: RenderJob) -> None:
+        """
+        Finds the pixels of the given render that are copied by symmetry, then starts computing
+        its strips (on a worker thread, since finding them takes too long for the event loop)
+        """
+        if job.cancelled:
+            return
+
+        job.source = symmetric_source(job.frac.symmetries(), job.x_range, job.y_range,
+                                      job.width, job.height)
+        for y0 in range(0, job.height, STRIP):
+            if job.cancelled:
+                return
+            job.futures.append(self._executor.submit(self._render_strip, job, y0))
+
+    def _render_strip(self, job: RenderJob, y0: int) -> None:
+        """
+        Computes a strip of rows of the given render (on a worker thread)
+        """
+        if job.cancelled:
+            return
+
+        rows = min(STRIP, job.height - y0)
+        c = complex_grid(job.x_range, job.y_range, job.width, job.height, 0, y0, job.width, rows)
+        if job.source is None:
+            job.counts[y0:y0 + rows] = job.frac.base_grid(c, MAX_IT)
+        else:
+            # Only compute the pixels that are not copied from another pixel by symmetry
+            start = y0 * job.width
+            todo = job.source[start:start + rows * job.width] == \
+                np.arange(start, start + rows * job.width)
+            job.counts.ravel()[start:start + rows * job.width][todo] = \
+                job.frac.base_grid(c.ravel()[todo], MAX_IT)
+
+        with job.lock:
+            job.remaining -= 1
+            last = job.remaining == 0
+        if last and not job.cancelled:
+            if job.source is not None:
+                job.counts = job.counts.ravel()[job.source].reshape(job.height, job.width)
+            job.rgb = colour_counts(job.counts)
+            self._finished.put(job)
+
+    def _poll(self, dt: float) -> None:
+        """
+        Hands any finished render (or stage of a render) to on_done (on the event loop thread)
+        """
+        while True:
+            try:
+                job = self._finished.get_nowait()
+            except queue.Empty:
+                return
+
+            if job is not self._job:  # A newer render was requested after this one finished
+                continue
+            if job.remaining == 0:
+                self._job = None
+
+            # The positive pitch means the first row is the bottom of the image, as pyglet's y
+            # axis points up
+            image = pyglet.image.ImageData(job.width, job.height, 'RGB', job.rgb.tobytes(),
+                                           pitch=3 * job.width)
+            self.on_done(job, image)
+
+
+class BuddhabrotRenderer(BackgroundRenderer):
+    """
+    Renders Buddhabrot images of a fractal in a worker thread (which shares the samples between a
+    pool of processes) and hands each stage of the image to the pyglet event loop as it builds up
+
+    Instance Attributes:
+      - samples: the number of points sampled for each image
+      - processes: the largest number of processes sampling points, or None for one per core
+
+    Representation Invariants:
+      - frac is a MandelbrotSet (or has its z0, power and valid_radius attributes)
+    """
+
+    def __init__(self, frac: Fractal, on_done, samples: int = 1000000, processes: int = None,
+                 interval: float = 1 / 60):
+        BackgroundRenderer.__init__(self, frac, on_done, 1, interval)
+        self.samples = samples
+        self.processes = processes
+        self._stop = threading.Event()
+
+    def request(self, x_range: DRange, y_range: DRange, power: float = None) -> None:
+        """
+        Starts rendering a Buddhabrot image over the given ranges with the given power (or the
+        power of the latest requested render), cancelling any render in progress
+        """
+        self.cancel()
+        self.x_range = x_range
+        self.y_range = y_range
+        if power is not None:
+            self.power = power
+
+        job = RenderJob(self.frac, x_range, y_range, self.power, self.frac.get_width(),
+                        self.frac.get_height())
+        job.frac.x_range = x_range
+        job.frac.y_range = y_range
+        job.remaining = 1
+
+        self._stop = threading.Event()
+        self._job = job
+        job.futures.append(self._executor.submit(self._render, job, self._stop))
+
+    def cancel(self) -> None:
+        """
+        Cancels the render in progress, if there is one
+        """
+        self._stop.set()
+        BackgroundRenderer.cancel(self)
+
+    def _render(self, job: RenderJob, stop: threading.Event) -> None:
+        """
+        Renders the Buddhabrot image of the given render (on the worker thread), handing over each
+        stage of the image
+        """
+        def progress(fraction: float, hist: np.ndarray) -> None:
+            """
+            Hands the image so far to the event loop
+            """
+            if job.cancelled:
+                return
+            job.rgb = buddhabrot_colours(hist)
+            if fraction >= 1:
+                job.remaining = 0
+            self._finished.put(job)
+
+        if not job.cancelled:
+            render_buddhabrot(job.frac, self.samples, job.width, job.height,
+                              workers=self.processes, progress=progress, stop=stop)
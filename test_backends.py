@@ -0,0 +1,25 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains the tests of the iteration backends in backends.py.
+"""
+import pytest
+
+from backends import available_backends, check_backends, get_backend
+
+
+def test_backends_agree() -> None:
+    """
+    Test that every available backend gives exactly the same iteration counts and orbits as the
+    python backend
+    """
+    assert check_backends(size=64) == {name: 0 for name in available_backends()}
+
+
+def test_unknown_backend() -> None:
+    """
+    Test that asking for a backend that does not exist raises a ValueError naming it
+    """
+    with pytest.raises(ValueError, match='cuda'):
+        get_backend('cuda')
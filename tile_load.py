@@ -0,0 +1,128 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains a load generator for the local tile server in tile_server.py, used to measure
+its throughput and latency.
+
+A number of clients each keep a connection open and request random tiles, one after another, from
+the given zoom levels. Picking tiles from a small set of zoom levels means some requests are
+repeated, which exercises both the tile cache and the merging of duplicate requests.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str,
+                   path: str) -> int:
+    """
+    Makes a single request over an open connection and returns the status of the response
+
+    Raise a ConnectionError if the server closes the connection instead of responding.
+    """
+    writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, host)).encode())
+    await writer.drain()
+
+    status_line = (await reader.readline()).split()
+    if len(status_line) < 2:
+        raise ConnectionResetError('The server closed the connection')
+    status = int(status_line[1])
+
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _client(host: str, port: int, paths: list, latencies: list, errors: list) -> None:
+    """
+    Requests each of the given paths in turn over a single connection, recording the latency of
+    each request
+
+    A request the server closes the connection on is recorded as an error, and the client carries
+    on over a new connection.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                status = await _request(reader, writer, host, path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                latencies.append(time.perf_counter() - start)
+                errors.append(path)
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(path)
+    finally:
+        writer.close()
+
+
+def _percentile(values: list, p: float) -> float:
+    """
+    Returns the p-th percentile of a sorted list of values
+    """
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def run_load(host: str = '127.0.0.1', port: int = 8000, clients: int = 16,
+                   requests: int = 64, zooms: tuple = (2, 3, 4), seed: int = 0) -> dict:
+    """
+    Runs the given number of clients, each making the given number of tile requests, and returns
+    the throughput (requests per second) and latency percentiles (seconds) of the server
+    """
+    rng = random.Random(seed)
+    plans = []
+    for _ in range(clients):
+        paths = []
+        for _ in range(requests):
+            z = rng.choice(zooms)
+            paths.append('/%d/%d/%d.png' % (z, rng.randrange(2 ** z), rng.randrange(2 ** z)))
+        plans.append(paths)
+
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, paths, latencies, errors) for paths in plans))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'seconds': elapsed,
+            'throughput': len(latencies) / elapsed,
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'p99': _percentile(latencies, 99),
+            'max': latencies[-1]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the throughput and latency of the '
+                                                 'tile server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--zooms', type=int, nargs='+', default=[2, 3, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load(args.host, args.port, args.clients, args.requests,
+                                   tuple(args.zooms), args.seed))
+    print('%d requests (%d errors) in %.2f s: %.1f requests/s'
+          % (results['requests'], results['errors'], results['seconds'], results['throughput']))
+    print('latency p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, max %.1f ms'
+          % tuple(1000 * results[key] for key in ('p50', 'p95', 'p99', 'max')))
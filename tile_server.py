@@ -0,0 +1,215 @@
+"""
+Finn Williams
+2021/04/16
+
+This file contains a local tile server, used to browse the Mandelbrot set (or one of its
+derivatives) from a web map viewer or a script instead of the pyglet window.
+
+Tiles are served at /{z}/{x}/{y}.png in the usual slippy map layout: zoom level z splits the
+square region of the complex plane into 2^z by 2^z tiles, with x increasing to the right and y
+increasing downwards. Tiles are rendered by a pool of processes, requests for a tile that is
+already being rendered wait for that render rather than starting another, and recently rendered
+tiles are kept in a bounded cache. The statistics of the server are served at /stats.
+
+Run this file to start the server, and see tile_load.py to measure its throughput and latency.
+"""
+import argparse
+import asyncio
+import io
+import json
+import re
+from collections import OrderedDict
+
+from PIL import Image
+
+from backends import process_pool
+from fractal import MAX_IT, complex_grid, colour_counts
+from mandelbrot import escape_counts
+from math_functions import DRange
+
+TILE_SIZE = 256
+MAX_ZOOM = 40  # Past this, neighbouring pixels are too close together for double precision
+
+TILE_PATH = re.compile(r'^/(\d+)/(\d+)/(\d+)\.png$')
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+
+def _render_tile(settings: tuple, z: int, x: int, y: int) -> bytes:
+    """
+    Renders a single tile and returns it encoded as a PNG
+    """
+    z0, power, valid_radius, max_it, center, size, tile_size = settings
+    span = size / 2 ** z
+    x_min = center.real - size / 2 + x * span
+    y_max = center.imag + size / 2 - y * span
+
+    c = complex_grid(DRange(x_min + span, x_min), DRange(y_max, y_max - span),
+                     tile_size, tile_size)[::-1]  # The first row of a tile is its top
+    counts = escape_counts(c, z0, power, valid_radius, max_it)
+
+    data = io.BytesIO()
+    Image.fromarray(colour_counts(counts, max_it)).save(data, format='PNG')
+    return data.getvalue()
+
+
+class TileServer:
+    """
+    An asyncio HTTP server that renders and serves tiles of the Mandelbrot set (or one of its
+    derivatives)
+
+    Instance Attributes:
+      - center: the complex number at the center of the zoom level 0 tile
+      - size: the width (and height) of the zoom level 0 tile on the complex plane
+      - cache_size: the largest number of tiles kept in the cache
+      - stats: counts of requests, cache hits, merged requests, renders and failed renders
+    """
+
+    def __init__(self, z0: complex = complex(0, 0), power: float = 2.0, max_it: int = MAX_IT,
+                 valid_radius: float = 2, center: complex = complex(-0.5, 0),
+                 size: float = 4.0, tile_size: int = TILE_SIZE, cache_size: int = 1024,
+                 workers: int = None):
+        self.center = center
+        self.size = size
+        self.cache_size = cache_size
+        self.stats = {'requests': 0, 'cache_hits': 0, 'merged': 0, 'renders': 0, 'errors': 0}
+
+        self._settings = (z0, power, valid_radius, max_it, center, size, tile_size)
+        self._workers = workers
+        self._executor = None
+        self._cache = OrderedDict()
+        self._pending = {}
+
+    async def get_tile(self, z: int, x: int, y: int) -> bytes:
+        """
+        Returns the PNG of the given tile from the cache, from a render already in progress, or
+        from a new render
+        """
+        key = (z, x, y)
+        self.stats['requests'] += 1
+
+        if key in self._cache:
+            self.stats['cache_hits'] += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        future = self._pending.get(key)
+        if future is None:
+            self.stats['renders'] += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, _render_tile, self._settings, z, x, y)
+            future.add_done_callback(lambda f: self._finish(key, f))
+            self._pending[key] = future
+        else:
+            self.stats['merged'] += 1
+
+        # A client disconnecting must not cancel a render other clients may be waiting for
+        return await asyncio.shield(future)
+
+    def _finish(self, key: tuple, future: asyncio.Future) -> None:
+        """
+        Moves a finished render from the pending renders into the cache
+        """
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        self._cache[key] = future.result()
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _respond(self, path: str) -> tuple:
+        """
+        Returns the status, content type and body of the response to a GET request for path
+        """
+        if path == '/stats':
+            stats = dict(self.stats, cached=len(self._cache), pending=len(self._pending))
+            return 200, 'application/json', json.dumps(stats).encode()
+
+        match = TILE_PATH.match(path)
+        if match is None:
+            return 404, 'text/plain', b'Not Found'
+
+        z, x, y = (int(group) for group in match.groups())
+        if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            return 404, 'text/plain', b'Not Found'
+
+        try:
+            return 200, 'image/png', await self.get_tile(z, x, y)
+        except Exception:  # The render failed, but the client still gets a response
+            self.stats['errors'] += 1
+            return 500, 'text/plain', b'Internal Server Error'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves the requests of a single connection, keeping it open between requests unless the
+        client asks otherwise
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, kind, body = 400, 'text/plain', b'Bad Request'
+                elif parts[0] != 'GET':
+                    status, kind, body = 405, 'text/plain', b'Method Not Allowed'
+                else:
+                    status, kind, body = await self._respond(parts[1].split('?')[0])
+
+                keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1' and \
+                    headers.get('connection') != 'close'
+
+                writer.write(('HTTP/1.1 %d %s\r\n' % (status, REASONS[status]) +
+                              'Content-Type: %s\r\n' % kind +
+                              'Content-Length: %d\r\n' % len(body) +
+                              'Access-Control-Allow-Origin: *\r\n' +
+                              'Connection: %s\r\n\r\n' % ('keep-alive' if keep_alive else 'close')
+                              ).encode('latin-1') + body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000) -> None:
+        """
+        Starts the render processes and serves tiles until cancelled
+        """
+        with process_pool(self._workers) as executor:
+            self._executor = executor
+            server = await asyncio.start_server(self._handle, host, port)
+            async with server:
+                await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve Mandelbrot set tiles over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--z0', type=complex, default=complex(0, 0))
+    parser.add_argument('--power', type=float, default=2.0)
+    parser.add_argument('--max-it', type=int, default=MAX_IT)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    tile_server = TileServer(args.z0, args.power, args.max_it,
+                             cache_size=args.cache_size, workers=args.workers)
+    try:
+        asyncio.run(tile_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass